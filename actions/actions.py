@@ -5,9 +5,10 @@ from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.types import DomainDict
 from datetime import datetime, date, time
 from rasa_sdk import Action
-from rasa_sdk.events import SlotSet
+from rasa_sdk.events import SlotSet, SessionStarted, ActionExecuted
 import re
 from database_connection import DbReservationSave
+from waitlist import waitlist, createWaitlistTable
 
 def clean_text(form_text):
     return "".join([c for c in form_text if c.isalpha()])
@@ -404,6 +405,9 @@ class SaveAppointmentInDatabase(Action):
             cursor.execute(createAppointmentsTable)
             connection.commit()
 
+            cursor.execute(createWaitlistTable)
+            connection.commit()
+
             # Extract from slots
             first_name = tracker.get_slot('first_name')
             last_name = tracker.get_slot('last_name')
@@ -419,27 +423,6 @@ class SaveAppointmentInDatabase(Action):
             department = tracker.get_slot('department')
         
 
-            # Insert data into the 'patients' table
-            insert_patient_query = """
-            INSERT INTO patients (first_name, last_name)
-            VALUES (%s, %s)
-            """
-            patient_data = (first_name, last_name)
-            cursor.execute(insert_patient_query, patient_data)
-            connection.commit()
-
-            # Retrieve the auto-generated patient_id
-            patient_id = cursor.lastrowid
-
-            # Insert data into the 'patients_extra_info' table
-            insert_extra_info_query = """
-            INSERT INTO patients_extra_info (patient_id, gender, age, weight_risk, hypertension, smoker, recent_surgeries)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            extra_info_data = (patient_id, gender, age, weight_risk, hypertension, smoker, recent_surgeries)
-            cursor.execute(insert_extra_info_query, extra_info_data)
-            connection.commit()
-
             # Check if the doctor already exists
             select_doctor_query = "SELECT id FROM doctors WHERE doctor_name = %s"
             cursor.execute(select_doctor_query, (doctor,))
@@ -480,6 +463,34 @@ class SaveAppointmentInDatabase(Action):
                 # Retrieve the auto-generated specialty_id
                 specialty_id = cursor.lastrowid
 
+            # The slot may be booked already or held for a patient from the waitlist
+            if waitlist.is_slot_taken(cursor, date, time, doctor_id, tracker.sender_id):
+                cursor.close()
+                connection.close()
+                dispatcher.utter_message("Intervalul ales nu mai este disponibil. Vă rugăm să alegeți altă dată sau oră.")
+                return []
+
+            # Insert data into the 'patients' table
+            insert_patient_query = """
+            INSERT INTO patients (first_name, last_name)
+            VALUES (%s, %s)
+            """
+            patient_data = (first_name, last_name)
+            cursor.execute(insert_patient_query, patient_data)
+            connection.commit()
+
+            # Retrieve the auto-generated patient_id
+            patient_id = cursor.lastrowid
+
+            # Insert data into the 'patients_extra_info' table
+            insert_extra_info_query = """
+            INSERT INTO patients_extra_info (patient_id, gender, age, weight_risk, hypertension, smoker, recent_surgeries)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """
+            extra_info_data = (patient_id, gender, age, weight_risk, hypertension, smoker, recent_surgeries)
+            cursor.execute(insert_extra_info_query, extra_info_data)
+            connection.commit()
+
             # Insert data into the 'appointments' table
             insert_appointment_query = """
             INSERT INTO appointments (patient_id, date, time, doctor_id, specialty_id)
@@ -489,6 +500,10 @@ class SaveAppointmentInDatabase(Action):
             cursor.execute(insert_appointment_query, appointment_data)
             connection.commit()
 
+            # A slot offered from the waitlist is now booked
+            waitlist.mark_booked(cursor, date, time, doctor_id, tracker.sender_id)
+            connection.commit()
+
             # Close the DbReservationSave and the connection
             cursor.close()
             connection.close()
@@ -633,26 +648,35 @@ class CancelAppointmentInDatabase(Action):
             cancel_department = tracker.get_slot('cancel_department')
             
             query = """
-            UPDATE appointments AS a
+            SELECT a.id FROM appointments AS a
             JOIN patients AS p ON a.patient_id = p.id
             JOIN doctors AS d ON a.doctor_id = d.id
             JOIN medical_specialties AS s ON a.specialty_id = s.id
-            SET a.status = 'canceled'
             WHERE
                 p.first_name = %s
                 AND p.last_name = %s
                 AND a.date = %s
                 AND s.specialty = %s
                 AND a.status = 'active'
+            FOR UPDATE
                 """
             cursor.execute(query, (cancel_first_name, cancel_last_name, cancel_date, cancel_department))
-            if cursor.rowcount > 0:
+            # Keep the ids so only these appointments are offered to the waitlist
+            canceled_ids = [row[0] for row in cursor.fetchall()]
+            if canceled_ids:
+                placeholders = ", ".join(["%s"] * len(canceled_ids))
+                cancel_query = f"UPDATE appointments SET status = 'canceled' WHERE id IN ({placeholders})"
+                cursor.execute(cancel_query, tuple(canceled_ids))
                 # Changes were made, appointment was found and canceled
                 dispatcher.utter_message("Programare anulată cu succes")
             else:
                 # No changes were made, appointment not found or already canceled
                 dispatcher.utter_message("Nu există programări pentru această dată")
             connection.commit()
+
+            if canceled_ids:
+                # Offer the freed slots to the waitlist in the background
+                waitlist.schedule_backfill(canceled_ids)
             
             cursor.close()
             connection.close()
@@ -665,4 +689,216 @@ class CancelAppointmentInDatabase(Action):
             if tracker.get_slot(slot_name) is None:
                 return False
 
-        return True
\ No newline at end of file
+        return True
+
+class ValidationWaitlistForm(FormValidationAction):
+    def name(self) -> Text:
+        return "validate_waitlist_form"
+
+    def validate_waitlist_first_name(
+        self,
+        slot_value: Any,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: DomainDict,
+    ) -> Dict[Text, Any]:
+        """Validate `waitlist_first_name` value."""
+        name = clean_text(slot_value)
+        if len(name) == 0:
+            dispatcher.utter_message(text="Cred că ați greșit.")
+            return {"waitlist_first_name": None}
+        return {"waitlist_first_name": name}
+
+    def validate_waitlist_last_name(
+        self,
+        slot_value: Any,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: DomainDict,
+    ) -> Dict[Text, Any]:
+        """Validate `waitlist_last_name` value."""
+        name = clean_text(slot_value)
+        if len(name) == 0:
+            dispatcher.utter_message(text="Cred că ați greșit.")
+            return {"waitlist_last_name": None}
+        first_name = tracker.get_slot("waitlist_first_name")
+        if len(first_name) + len(name) < 3:
+            dispatcher.utter_message(
+                text="Combinația nume/prenume este prea scurtă. Credem că s-a comis o eroare. Restartăm.")
+            return {"waitlist_first_name": None, "waitlist_last_name": None}
+        return {"waitlist_last_name": name}
+
+    def validate_waitlist_date(
+        self,
+        slot_value: Any,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any]
+    ) -> Dict[Text, Any]:
+        current_month = date.today().month
+        current_year = date.today().year
+        date_format1 = "%Y-%m-%d"  # Date format: YYYY-MM-DD
+        date_format2 = "%d/%m/%Y"  # Date format: DD/MM/YYYY
+        date_format3 = "%d.%m"  # Date format: DD.MM
+
+        if not slot_value:
+            dispatcher.utter_message("Vă rog să introduceți o dată")
+            return {"waitlist_date": None}
+        try:
+            # Try parsing date using format1
+            parsed_date = datetime.strptime(slot_value, date_format1)
+            return {"waitlist_date": parsed_date.date().isoformat()}
+
+        except ValueError:
+            try:
+                # Try parsing date using format2
+                parsed_date = datetime.strptime(slot_value, date_format2)
+                return {"waitlist_date": parsed_date.date().isoformat()}
+
+            except ValueError:
+                try:
+                    # Try parsing date using format3
+                    parsed_date = datetime.strptime(slot_value, date_format3)
+                    if parsed_date.month >= current_month:
+                        validated_date = f"{current_year}-{parsed_date.month:02d}-{parsed_date.day:02d}"
+                    else:
+                        validated_date = f"{current_year + 1}-{parsed_date.month:02d}-{parsed_date.day:02d}"
+                    return {"waitlist_date": validated_date}
+
+                except ValueError:
+                    # Invalid date format
+                    dispatcher.utter_message("Format invalid. Vă rugăm sa introduceți data sub următoarele forme: YYYY-MM-DD, DD/MM/YYYY, or DD.MM.")
+                    return {"waitlist_date": None}
+
+    def validate_waitlist_department(
+        self,
+        slot_value: Any,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> Dict[Text, Any]:
+        department_list = ["cardiologie", "dermatologie", "ortopedie", "pediatrie", "neurologie", "medicina generala", "oftalmologie"]
+
+        if not slot_value:
+            dispatcher.utter_message("Vă rugăm să introduceți numele departmentului.")
+            return {"waitlist_department": None}
+
+        if slot_value.lower() not in department_list:
+            dispatcher.utter_message(
+                "Departament invalid selectat. Puteți alege doar între: Cardiologie, Dermatologie, Ortopedie, Pediatrie, Neurologie, Medicina generala, Oftalmologie"
+            )
+            return {"waitlist_department": None}
+
+        return {"waitlist_department": slot_value}
+
+class JoinWaitlistInDatabase(Action):
+    def name(self) -> Text:
+        return "action_join_waitlist"
+
+    def run(self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any]
+    ) -> List[Dict[Text, Any]]:
+
+        if self.allSlotsFilled(tracker):
+            waitlist.join(
+                tracker.sender_id,
+                tracker.get_slot('waitlist_first_name'),
+                tracker.get_slot('waitlist_last_name'),
+                tracker.get_slot('waitlist_date'),
+                tracker.get_slot('waitlist_department'),
+            )
+            dispatcher.utter_message("Ați fost adăugat pe lista de așteptare. Vă anunțăm imediat ce se eliberează un loc.")
+        else:
+            dispatcher.utter_message("A apărut o eroare.")
+        return []
+
+    def allSlotsFilled(self, tracker: Tracker) -> bool:
+        required_slots = ['waitlist_first_name', 'waitlist_last_name', 'waitlist_date', 'waitlist_department']
+
+        for slot_name in required_slots:
+            if tracker.get_slot(slot_name) is None:
+                return False
+
+        return True
+
+def waitlist_offer_events(dispatcher: CollectingDispatcher, tracker: Tracker, shown_offer_id: Any = None) -> List[Dict[Text, Any]]:
+    """Show the patient a pending waitlist offer.
+
+    Only `waitlist_offer_id` is set here; the appointment slots are filled once
+    the patient accepts, so a booking they already started is left alone."""
+    offer = waitlist.pending_offer(tracker.sender_id)
+    if offer is None:
+        return []
+    waitlist_id, offer_date, offer_time, doctor, department = offer
+    if str(waitlist_id) == shown_offer_id:
+        return []
+    dispatcher.utter_message(response="utter_waitlist_offer", date=offer_date, time=offer_time, doctor=doctor, department=department)
+    return [SlotSet("waitlist_offer_id", str(waitlist_id))]
+
+class ActionSessionStart(Action):
+    def name(self) -> Text:
+        return "action_session_start"
+
+    def run(self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any]
+    ) -> List[Dict[Text, Any]]:
+        events = [SessionStarted()]
+        if domain.get("session_config", {}).get("carry_over_slots_to_new_session", True):
+            events.extend(SlotSet(slot, value) for slot, value in tracker.current_slot_values().items() if value is not None)
+
+        # Offers usually arrive while the patient is away, so check at the start of each session
+        events.extend(waitlist_offer_events(dispatcher, tracker))
+        events.append(ActionExecuted("action_listen"))
+        return events
+
+class CheckWaitlistOffer(Action):
+    def name(self) -> Text:
+        return "action_check_waitlist_offer"
+
+    def run(self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any]
+    ) -> List[Dict[Text, Any]]:
+        return waitlist_offer_events(dispatcher, tracker, tracker.get_slot("waitlist_offer_id"))
+
+class AcceptWaitlistOffer(Action):
+    def name(self) -> Text:
+        return "action_accept_waitlist_offer"
+
+    def run(self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any]
+    ) -> List[Dict[Text, Any]]:
+        offer = waitlist.accept(tracker.get_slot("waitlist_offer_id"), tracker.sender_id)
+        if offer is None:
+            dispatcher.utter_message("Ne pare rău, locul nu mai este disponibil.")
+            return [SlotSet("waitlist_offer_id", None)]
+
+        waitlist_id, offer_date, offer_time, doctor, department = offer
+        dispatcher.utter_message("Am păstrat locul pentru dumneavoastră. Mai avem nevoie de câteva informații.")
+        return [
+            SlotSet("waitlist_offer_id", None),
+            SlotSet("date", offer_date),
+            SlotSet("time", offer_time),
+            SlotSet("doctor", doctor),
+            SlotSet("department", department),
+        ]
+
+class DeclineWaitlistOffer(Action):
+    def name(self) -> Text:
+        return "action_decline_waitlist_offer"
+
+    def run(self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any]
+    ) -> List[Dict[Text, Any]]:
+        waitlist.decline(tracker.get_slot("waitlist_offer_id"), tracker.sender_id)
+        dispatcher.utter_message("Am înțeles. Oferim locul următorului pacient de pe lista de așteptare.")
+        return [SlotSet("waitlist_offer_id", None)]
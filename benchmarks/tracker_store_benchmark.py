@@ -0,0 +1,100 @@
+"""Measure tracker load and save times of the SQLite tracker store.
+
+Simulates many senders talking to the bot at the same time: every sender
+repeatedly loads its tracker, appends a user turn and a bot turn and saves it
+back, like the Rasa server does for each message. The store runs its database
+work on a thread pool, so the loads and saves of different senders overlap
+just like they do in the server; the reported times include waiting for a
+free worker and for the SQLite write lock.
+
+run from the project root with: python benchmarks/tracker_store_benchmark.py
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from rasa.core.tracker_store import InMemoryTrackerStore
+from rasa.shared.core.domain import Domain
+from rasa.shared.core.events import ActionExecuted, BotUttered, SessionStarted, UserUttered
+from rasa.shared.core.trackers import DialogueStateTracker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlite_tracker_store import SQLiteTrackerStore  # noqa: E402
+
+
+async def converse(store, domain, sender_id, turns, sessions, load_times, save_times):
+    for turn in range(turns):
+        start = time.perf_counter()
+        tracker = await store.retrieve(sender_id)
+        load_times.append(time.perf_counter() - start)
+        if tracker is None:
+            tracker = DialogueStateTracker(sender_id, domain.slots)
+
+        # Start a new session every `turns / sessions` turns
+        if turn % max(turns // sessions, 1) == 0:
+            tracker.update(SessionStarted())
+            tracker.update(ActionExecuted("action_listen"))
+        tracker.update(UserUttered(f"mesaj {turn}", {"name": "greet", "confidence": 1.0}))
+        tracker.update(ActionExecuted("utter_greet"))
+        tracker.update(BotUttered("Bună ziua! Cu ce vă pot ajuta?"))
+        tracker.update(ActionExecuted("action_listen"))
+
+        start = time.perf_counter()
+        await store.save(tracker)
+        save_times.append(time.perf_counter() - start)
+        # Give the other senders a chance to run between turns
+        await asyncio.sleep(0)
+
+
+def report(name, times):
+    times = sorted(times)
+    p95 = times[int(len(times) * 0.95) - 1]
+    print(
+        f"{name:>6}: mean {statistics.mean(times) * 1000:.3f} ms, "
+        f"p95 {p95 * 1000:.3f} ms, max {times[-1] * 1000:.3f} ms"
+    )
+
+
+async def run(store, domain, senders, turns, sessions):
+    load_times, save_times = [], []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            converse(store, domain, f"sender-{sender}", turns, sessions, load_times, save_times)
+            for sender in range(senders)
+        ]
+    )
+    elapsed = time.perf_counter() - start
+    print(f"{senders} senders x {turns} turns in {elapsed:.2f} s ({senders * turns / elapsed:.0f} turns/s)")
+    report("load", load_times)
+    report("save", save_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    domain = Domain.load("domain.yml")
+
+    with tempfile.TemporaryDirectory() as directory:
+        print("SQLiteTrackerStore")
+        store = SQLiteTrackerStore(
+            domain, db=os.path.join(directory, "trackers.db"), eviction_interval=0, workers=args.workers
+        )
+        asyncio.run(run(store, domain, args.senders, args.turns, args.sessions))
+        store.close()
+
+    print("InMemoryTrackerStore")
+    asyncio.run(run(InMemoryTrackerStore(domain), domain, args.senders, args.turns, args.sessions))
+
+
+if __name__ == "__main__":
+    main()
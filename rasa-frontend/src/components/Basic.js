@@ -47,15 +47,13 @@ function Basic() {
             .then(response => response.json())
             .then((response) => {
                 if (response) {
-                    const temp = response[0];
-                    const recipient_id = temp["recipient_id"];
-                    const recipient_msg = temp["text"];
-
-
-                    const response_temp = { sender: "bot", recipient_id: recipient_id, msg: recipient_msg };
+                    // The bot can answer with several messages, e.g. a waitlist offer before the reply
+                    const response_temp = response
+                        .filter(temp => temp["text"])
+                        .map(temp => ({ sender: "bot", recipient_id: temp["recipient_id"], msg: temp["text"] }));
                     setBotTyping(false);
 
-                    setChat(chat => [...chat, response_temp]);
+                    setChat(chat => [...chat, ...response_temp]);
 
                 }
             })
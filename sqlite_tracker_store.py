@@ -0,0 +1,287 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Text
+
+from rasa.core.brokers.broker import EventBroker
+from rasa.core.tracker_store import TrackerStore
+from rasa.shared.core.domain import Domain
+from rasa.shared.core.events import SessionStarted
+from rasa.shared.core.trackers import DialogueStateTracker
+
+createEventsTable = """
+CREATE TABLE IF NOT EXISTS events
+(id INTEGER PRIMARY KEY AUTOINCREMENT,
+sender_id TEXT NOT NULL,
+data BLOB NOT NULL)"""
+createEventsIndex = """
+CREATE INDEX IF NOT EXISTS events_sender_id ON events (sender_id, id)"""
+createSnapshotsTable = """
+CREATE TABLE IF NOT EXISTS snapshots
+(sender_id TEXT NOT NULL PRIMARY KEY,
+event_count INTEGER NOT NULL,
+snapshot_count INTEGER NOT NULL,
+updated_at REAL NOT NULL,
+data BLOB NOT NULL)"""
+createSnapshotsIndex = """
+CREATE INDEX IF NOT EXISTS snapshots_updated_at ON snapshots (updated_at)"""
+
+
+def pack_events(events: List[Dict[Text, Any]]) -> bytes:
+    return zlib.compress(json.dumps(events, separators=(",", ":")).encode("utf-8"))
+
+
+def unpack_events(data: bytes) -> List[Dict[Text, Any]]:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def current_session(events: List[Dict[Text, Any]]) -> List[Dict[Text, Any]]:
+    """Return the events from the latest `session_started` event onwards."""
+    for index in range(len(events) - 1, -1, -1):
+        if events[index].get("event") == SessionStarted.type_name:
+            return events[index:]
+    return events
+
+
+class SQLiteTrackerStore(TrackerStore):
+    """Tracker store backed by a local SQLite file in WAL mode.
+
+    Every save appends the new events as one compressed batch to `events` and
+    rewrites the sender's row in `snapshots`, which holds the compressed events
+    of the current session only. `retrieve` reads that single row, so loading a
+    tracker does not replay older sessions; slots carried over to a new session
+    are part of it through the `slot` events emitted by `action_session_start`.
+    With `retrieve_events_from_previous_conversation_sessions` set, `retrieve`
+    returns every session like `retrieve_full_tracker`.
+
+    Like `SQLTrackerStore`, new events are found by counting: `snapshots` keeps
+    how many events were saved in total and in the current session, and
+    `save` appends whatever the tracker holds beyond that.
+
+    The database work runs on a pool of `workers` threads, each with its own
+    connection, so it never blocks the event loop. Trackers idle for longer
+    than `tracker_ttl` seconds are evicted by a background thread every
+    `eviction_interval` seconds.
+
+    Configure it in `endpoints.yml`:
+
+        tracker_store:
+          type: sqlite_tracker_store.SQLiteTrackerStore
+          db: trackers.db
+    """
+
+    def __init__(
+        self,
+        domain: Optional[Domain] = None,
+        db: Text = "trackers.db",
+        tracker_ttl: float = 7 * 24 * 60 * 60,
+        eviction_interval: float = 10 * 60,
+        workers: int = 4,
+        retrieve_events_from_previous_conversation_sessions: bool = False,
+        event_broker: Optional[EventBroker] = None,
+        **kwargs: Any,
+    ) -> None:
+        # `host` is always passed for stores loaded from `endpoints.yml`
+        kwargs.pop("host", None)
+        super().__init__(
+            domain,
+            event_broker,
+            retrieve_events_from_previous_conversation_sessions=retrieve_events_from_previous_conversation_sessions,
+            **kwargs,
+        )
+
+        self.db = db
+        self.tracker_ttl = float(tracker_ttl)
+        self.retrieve_events_from_previous_conversation_sessions = bool(
+            retrieve_events_from_previous_conversation_sessions
+        )
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(workers), thread_name_prefix="sqlite-tracker-store"
+        )
+
+        connection = self._connection()
+        connection.execute(createEventsTable)
+        connection.execute(createEventsIndex)
+        connection.execute(createSnapshotsTable)
+        connection.execute(createSnapshotsIndex)
+
+        self._stopped = threading.Event()
+        self._evictor = None
+        if float(eviction_interval) > 0:
+            self._evictor = threading.Thread(
+                target=self._evict_periodically,
+                args=(float(eviction_interval),),
+                name="sqlite-tracker-store-evictor",
+                daemon=True,
+            )
+            self._evictor.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Transactions are started explicitly, see `_save`
+            connection = sqlite3.connect(
+                self.db, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            # WAL lets readers run while another thread writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    async def _run(self, function: Any, *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def save(self, tracker: DialogueStateTracker) -> None:
+        if self.event_broker:
+            await self.stream_events(tracker)
+
+        events = [event.as_dict() for event in tracker.events]
+        await self._run(self._save, tracker.sender_id, events)
+
+    def _save(self, sender_id: Text, events: List[Dict[Text, Any]]) -> None:
+        connection = self._connection()
+        # Take the write lock up front so the counts cannot change under us
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT event_count, snapshot_count FROM snapshots WHERE sender_id = ?",
+                (sender_id,),
+            ).fetchone()
+            event_count, snapshot_count = row or (0, 0)
+
+            # The tracker holds what `retrieve` returned plus the new events
+            if self.retrieve_events_from_previous_conversation_sessions:
+                new_events = events[event_count:]
+            else:
+                new_events = events[snapshot_count:]
+            if row and not new_events:
+                connection.execute("ROLLBACK")
+                return
+
+            if new_events:
+                connection.execute(
+                    "INSERT INTO events (sender_id, data) VALUES (?, ?)",
+                    (sender_id, pack_events(new_events)),
+                )
+            snapshot = current_session(events)
+            connection.execute(
+                """
+                INSERT OR REPLACE INTO snapshots
+                (sender_id, event_count, snapshot_count, updated_at, data)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    sender_id,
+                    event_count + len(new_events),
+                    len(snapshot),
+                    time.time(),
+                    pack_events(snapshot),
+                ),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    async def retrieve(self, sender_id: Text) -> Optional[DialogueStateTracker]:
+        if self.retrieve_events_from_previous_conversation_sessions:
+            return await self.retrieve_full_tracker(sender_id)
+        return await self._run(self._retrieve_snapshot, sender_id)
+
+    def _retrieve_snapshot(self, sender_id: Text) -> Optional[DialogueStateTracker]:
+        row = self._connection().execute(
+            "SELECT data FROM snapshots WHERE sender_id = ?", (sender_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._tracker_from_events(sender_id, unpack_events(row[0]))
+
+    async def retrieve_full_tracker(
+        self, sender_id: Text
+    ) -> Optional[DialogueStateTracker]:
+        return await self._run(self._retrieve_full_tracker, sender_id)
+
+    def _retrieve_full_tracker(self, sender_id: Text) -> Optional[DialogueStateTracker]:
+        rows = self._connection().execute(
+            "SELECT data FROM events WHERE sender_id = ? ORDER BY id", (sender_id,)
+        ).fetchall()
+        if not rows:
+            return None
+        events = [event for (data,) in rows for event in unpack_events(data)]
+        return self._tracker_from_events(sender_id, events)
+
+    async def keys(self) -> Iterable[Text]:
+        return await self._run(self._keys)
+
+    def _keys(self) -> List[Text]:
+        rows = self._connection().execute("SELECT sender_id FROM snapshots").fetchall()
+        return [sender_id for (sender_id,) in rows]
+
+    def _tracker_from_events(
+        self, sender_id: Text, events: List[Dict[Text, Any]]
+    ) -> DialogueStateTracker:
+        return DialogueStateTracker.from_dict(
+            sender_id,
+            events,
+            self.domain.slots if self.domain else None,
+            self.max_event_history,
+        )
+
+    def evict_expired(self) -> int:
+        """Delete trackers idle for longer than `tracker_ttl`, return how many."""
+        expired_before = time.time() - self.tracker_ttl
+        connection = self._connection()
+        expired = [
+            sender_id
+            for (sender_id,) in connection.execute(
+                "SELECT sender_id FROM snapshots WHERE updated_at < ?",
+                (expired_before,),
+            ).fetchall()
+        ]
+        evicted = 0
+        for sender_id in expired:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # A sender who came back after the query keeps their tracker
+                deleted = connection.execute(
+                    "DELETE FROM snapshots WHERE sender_id = ? AND updated_at < ?",
+                    (sender_id, expired_before),
+                ).rowcount
+                if deleted:
+                    connection.execute("DELETE FROM events WHERE sender_id = ?", (sender_id,))
+                    evicted += 1
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return evicted
+
+    def _evict_periodically(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            try:
+                self.evict_expired()
+            except sqlite3.Error:
+                # Try again on the next run, e.g. when the database was busy
+                pass
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._evictor is not None:
+            self._evictor.join()
+        self._executor.shutdown(wait=True)
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sqlite3
+import sys
+
+import pytest
+from rasa.shared.core.domain import Domain
+from rasa.shared.core.events import ActionExecuted, SessionStarted, SlotSet, UserUttered
+from rasa.shared.core.trackers import DialogueStateTracker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlite_tracker_store import SQLiteTrackerStore, unpack_events  # noqa: E402
+
+DOMAIN = Domain.from_yaml(
+    """
+version: "3.1"
+entities:
+- first_name
+slots:
+  first_name:
+    type: text
+    mappings:
+    - type: from_entity
+      entity: first_name
+"""
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteTrackerStore(DOMAIN, db=str(tmp_path / "trackers.db"), tracker_ttl=60, eviction_interval=0)
+    yield store
+    store.close()
+
+
+def two_session_tracker(sender_id):
+    tracker = DialogueStateTracker(sender_id, DOMAIN.slots)
+    tracker.update(SessionStarted())
+    tracker.update(ActionExecuted("action_listen"))
+    tracker.update(UserUttered("mă numesc Ana", {"name": "name_form", "confidence": 1.0}))
+    tracker.update(SlotSet("first_name", "Ana"))
+    tracker.update(ActionExecuted("utter_greet"))
+    tracker.update(ActionExecuted("action_listen"))
+    # Second session, as emitted by action_session_start with carried over slots
+    tracker.update(SessionStarted())
+    tracker.update(SlotSet("first_name", "Ana"))
+    tracker.update(ActionExecuted("action_listen"))
+    tracker.update(UserUttered("bună ziua", {"name": "greet", "confidence": 1.0}))
+    return tracker
+
+
+def event_batches(store, sender_id):
+    connection = sqlite3.connect(store.db)
+    rows = connection.execute("SELECT data FROM events WHERE sender_id = ? ORDER BY id", (sender_id,)).fetchall()
+    connection.close()
+    return [unpack_events(data) for (data,) in rows]
+
+
+def test_retrieve_returns_current_session_with_carried_over_slots(store):
+    asyncio.run(store.save(two_session_tracker("ana")))
+
+    tracker = asyncio.run(store.retrieve("ana"))
+
+    assert len(tracker.events) == 4
+    assert isinstance(tracker.events[0], SessionStarted)
+    assert tracker.get_slot("first_name") == "Ana"
+
+
+def test_retrieve_full_tracker_returns_every_session(store):
+    asyncio.run(store.save(two_session_tracker("ana")))
+
+    tracker = asyncio.run(store.retrieve_full_tracker("ana"))
+
+    assert len(tracker.events) == 10
+    assert sum(isinstance(event, SessionStarted) for event in tracker.events) == 2
+
+
+def test_retrieve_honors_previous_sessions_flag(tmp_path):
+    store = SQLiteTrackerStore(
+        DOMAIN,
+        db=str(tmp_path / "trackers.db"),
+        eviction_interval=0,
+        retrieve_events_from_previous_conversation_sessions=True,
+    )
+    asyncio.run(store.save(two_session_tracker("ana")))
+
+    tracker = asyncio.run(store.retrieve("ana"))
+    tracker.update(ActionExecuted("utter_greet"))
+    asyncio.run(store.save(tracker))
+    store.close()
+
+    assert len(tracker.events) == 11
+    assert [len(batch) for batch in event_batches(store, "ana")] == [10, 1]
+
+
+def test_second_save_appends_only_new_events(store):
+    asyncio.run(store.save(two_session_tracker("ana")))
+    tracker = asyncio.run(store.retrieve("ana"))
+    tracker.update(ActionExecuted("utter_greet"))
+    # Events with older timestamps are new as well
+    tracker.update(ActionExecuted("action_listen", timestamp=0))
+
+    asyncio.run(store.save(tracker))
+
+    assert [len(batch) for batch in event_batches(store, "ana")] == [10, 2]
+    assert len(asyncio.run(store.retrieve("ana")).events) == 6
+    assert len(asyncio.run(store.retrieve_full_tracker("ana")).events) == 12
+
+
+def test_evict_expired_keeps_senders_active_since(store):
+    asyncio.run(store.save(two_session_tracker("ana")))
+    asyncio.run(store.save(two_session_tracker("ben")))
+    connection = sqlite3.connect(store.db)
+    connection.execute("UPDATE snapshots SET updated_at = updated_at - 120")
+    connection.commit()
+    connection.close()
+
+    tracker = asyncio.run(store.retrieve("ben"))
+    tracker.update(UserUttered("mai sunt aici", {"name": "greet", "confidence": 1.0}))
+    asyncio.run(store.save(tracker))
+
+    assert store.evict_expired() == 1
+    assert asyncio.run(store.retrieve("ana")) is None
+    assert event_batches(store, "ana") == []
+    assert asyncio.run(store.retrieve("ben")) is not None
+    assert sorted(asyncio.run(store.keys())) == ["ben"]
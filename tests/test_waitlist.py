@@ -0,0 +1,273 @@
+import os
+import sys
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import waitlist as waitlist_module  # noqa: E402
+from waitlist import Waitlist  # noqa: E402
+
+TOMORROW = (date.today() + timedelta(days=1)).isoformat()
+YESTERDAY = (date.today() - timedelta(days=1)).isoformat()
+
+
+class FakeCursor:
+    """Answers the waitlist queries from the rows of a `FakeDatabase`."""
+
+    def __init__(self, database):
+        self.database = database
+        self.rowcount = 0
+        self.lastrowid = None
+        self._result = []
+
+    def execute(self, query, params=()):
+        query = " ".join(query.split())
+        self.database.queries.append((query, params))
+        self._result = []
+        self.rowcount = 0
+        rows = self.database.rows
+
+        if query.startswith("INSERT INTO waitlist"):
+            sender_id, first_name, last_name, row_date, department = params
+            self.lastrowid = max(rows, default=0) + 1
+            rows[self.lastrowid] = {
+                "sender_id": sender_id, "department": department, "date": row_date,
+                "status": "waiting", "appointment_id": None,
+            }
+        elif query.startswith("SELECT id, sender_id FROM waitlist"):
+            department, row_date = params
+            self._result = [
+                (waitlist_id, row["sender_id"])
+                for waitlist_id, row in rows.items()
+                if (row["department"], row["date"], row["status"]) == (department, row_date, "waiting")
+            ]
+        elif query.startswith("SELECT a.id, a.date, s.specialty"):
+            self._result = [appointment for appointment in self.database.freed if appointment[0] in params]
+        elif query.startswith("UPDATE waitlist SET status = 'offered'"):
+            appointment_id, waitlist_id = params
+            if rows[waitlist_id]["status"] == "waiting":
+                rows[waitlist_id].update(status="offered", appointment_id=appointment_id)
+                self.rowcount = 1
+        elif query.startswith("SELECT w.id, w.appointment_id"):
+            self._result = list(self.database.expired)
+        elif query.startswith("UPDATE waitlist SET status = 'expired'"):
+            (waitlist_id,) = params
+            if rows[waitlist_id]["status"] in ("offered", "accepted"):
+                rows[waitlist_id]["status"] = "expired"
+                self.rowcount = 1
+        elif query.startswith("SELECT appointment_id FROM waitlist"):
+            waitlist_id, sender_id = params
+            self._result = [(rows[waitlist_id]["appointment_id"],)]
+        elif query.startswith("UPDATE waitlist SET status = 'declined'"):
+            waitlist_id, sender_id = params
+            if rows[waitlist_id]["status"] in ("offered", "accepted"):
+                rows[waitlist_id]["status"] = "declined"
+                self.rowcount = 1
+        elif query.startswith("SELECT 1 FROM appointments"):
+            self._result = [(1,)] if params in self.database.active else []
+        elif query.startswith("SELECT 1 FROM waitlist"):
+            slot, sender_id = params[:3], params[3]
+            self._result = [(1,)] if self.database.held.get(slot, sender_id) != sender_id else []
+
+    def fetchall(self):
+        return self._result
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.rows = {}
+        self.freed = []
+        self.expired = []
+        self.active = set()
+        self.held = {}
+        self.queries = []
+        self.fail_on = None
+
+    def cursor(self):
+        cursor = FakeCursor(self)
+        if self.fail_on:
+            execute = cursor.execute
+
+            def failing_execute(query, params=()):
+                if query.strip().startswith(self.fail_on):
+                    raise RuntimeError("connection lost")
+                execute(query, params)
+
+            cursor.execute = failing_execute
+        return cursor
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def add(self, sender_id, department="cardiologie", row_date=TOMORROW, status="waiting"):
+        waitlist_id = max(self.rows, default=0) + 1
+        self.rows[waitlist_id] = {
+            "sender_id": sender_id, "department": department, "date": row_date,
+            "status": status, "appointment_id": None,
+        }
+        return waitlist_id
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(waitlist_module, "DbReservationSave", lambda: database)
+    return database
+
+
+@pytest.fixture
+def waitlist():
+    waitlist = Waitlist()
+    # Run background work right away so the tests can check its outcome
+    waitlist._submit = lambda function, *args: function(*args)
+    return waitlist
+
+
+def offered_to(database, appointment_id):
+    return [row["sender_id"] for row in database.rows.values() if row["appointment_id"] == appointment_id]
+
+
+def test_creating_a_waitlist_starts_no_threads():
+    threads = threading.active_count()
+
+    Waitlist()
+
+    assert threading.active_count() == threads
+
+
+def test_backfill_offers_slots_in_joining_order(database, waitlist):
+    waitlist.join("ana", "Ana", "Popescu", TOMORROW, "Cardiologie")
+    waitlist.join("ben", "Ben", "Ionescu", TOMORROW, "Cardiologie")
+    waitlist.join("dan", "Dan", "Radu", TOMORROW, "Cardiologie")
+    database.freed = [(10, TOMORROW, "Cardiologie"), (11, TOMORROW, "Cardiologie")]
+
+    waitlist.backfill([10, 11])
+
+    assert offered_to(database, 10) == ["ana"]
+    assert offered_to(database, 11) == ["ben"]
+    assert database.rows[3]["status"] == "waiting"
+
+
+def test_backfill_skips_slots_the_query_filters_out(database, waitlist):
+    waitlist.join("ana", "Ana", "Popescu", TOMORROW, "Cardiologie")
+    # Appointment 10 was booked again or is already offered
+    database.freed = []
+
+    waitlist.backfill([10])
+
+    assert database.rows[1]["status"] == "waiting"
+    freed_query = next(query for query, _ in database.queries if query.startswith("SELECT a.id, a.date"))
+    assert "w.status IN ('offered', 'accepted', 'booked')" in freed_query
+    assert "b.status = 'active'" in freed_query
+
+
+def test_backfill_moves_past_entries_handled_elsewhere(database, waitlist):
+    waitlist.join("ana", "Ana", "Popescu", TOMORROW, "Cardiologie")
+    waitlist.join("ben", "Ben", "Ionescu", TOMORROW, "Cardiologie")
+    # Another action server process offered Ana a slot meanwhile
+    database.rows[1]["status"] = "offered"
+    database.freed = [(10, TOMORROW, "Cardiologie")]
+
+    waitlist.backfill([10])
+
+    assert offered_to(database, 10) == ["ben"]
+
+
+def test_backfill_rebuilds_an_empty_queue(database, waitlist):
+    waitlist.join("ana", "Ana", "Popescu", TOMORROW, "Cardiologie")
+    database.freed = [(10, TOMORROW, "Cardiologie"), (11, TOMORROW, "Cardiologie")]
+    waitlist.backfill([10])
+    # Ben joined through another process, so the cached queue is empty
+    database.add("ben")
+
+    waitlist.backfill([11])
+
+    assert offered_to(database, 11) == ["ben"]
+
+
+def test_failed_backfill_drops_the_touched_queue(database, waitlist):
+    waitlist.join("ana", "Ana", "Popescu", TOMORROW, "Cardiologie")
+    database.freed = [(10, TOMORROW, "Cardiologie")]
+    database.fail_on = "UPDATE waitlist SET status = 'offered'"
+
+    with pytest.raises(RuntimeError):
+        waitlist.backfill([10])
+
+    assert ("cardiologie", TOMORROW) not in waitlist._queues
+    database.fail_on = None
+    waitlist.backfill([10])
+    assert offered_to(database, 10) == ["ana"]
+
+
+def test_join_drops_queues_of_past_dates(database, waitlist):
+    waitlist._queues[("cardiologie", YESTERDAY)] = [(1, "ana")]
+
+    waitlist.join("ben", "Ben", "Ionescu", TOMORROW, "Cardiologie")
+
+    assert list(waitlist._queues) == [("cardiologie", TOMORROW)]
+
+
+def test_decline_offers_the_slot_to_the_next_patient(database, waitlist):
+    waitlist.join("ana", "Ana", "Popescu", TOMORROW, "Cardiologie")
+    waitlist.join("ben", "Ben", "Ionescu", TOMORROW, "Cardiologie")
+    database.freed = [(10, TOMORROW, "Cardiologie")]
+    waitlist.backfill([10])
+
+    assert waitlist.decline(1, "ana")
+
+    assert database.rows[1]["status"] == "declined"
+    assert database.rows[2]["status"] == "offered"
+    assert database.rows[2]["appointment_id"] == 10
+    assert not waitlist.decline(1, "ana")
+
+
+def test_expire_offers_passes_the_slot_on(database, waitlist):
+    waitlist.join("ana", "Ana", "Popescu", TOMORROW, "Cardiologie")
+    waitlist.join("ben", "Ben", "Ionescu", TOMORROW, "Cardiologie")
+    database.freed = [(10, TOMORROW, "Cardiologie")]
+    waitlist.backfill([10])
+    database.expired = [(1, 10)]
+
+    waitlist.expire_offers()
+
+    assert database.rows[1]["status"] == "expired"
+    assert offered_to(database, 10) == ["ana", "ben"]
+    assert database.rows[2]["status"] == "offered"
+    params = next(
+        params for query, params in database.queries if query.startswith("SELECT w.id, w.appointment_id")
+    )
+    assert params == (waitlist.offer_timeout_hours, waitlist.unseen_offer_timeout_hours)
+
+
+def test_is_slot_taken(database):
+    cursor = database.cursor()
+    database.active.add((TOMORROW, "9:00", 1))
+    database.held[(TOMORROW, "10:00", 1)] = "ana"
+
+    assert Waitlist.is_slot_taken(cursor, TOMORROW, "9:00", 1, "ana")
+    assert Waitlist.is_slot_taken(cursor, TOMORROW, "10:00", 1, "ben")
+    assert not Waitlist.is_slot_taken(cursor, TOMORROW, "10:00", 1, "ana")
+    assert not Waitlist.is_slot_taken(cursor, TOMORROW, "11:00", 1, "ben")
+
+
+def test_mark_booked_only_marks_the_patients_offer(database):
+    cursor = database.cursor()
+
+    Waitlist.mark_booked(cursor, TOMORROW, "10:00", 1, "ana")
+
+    query, params = database.queries[-1]
+    assert query.startswith("UPDATE waitlist AS w")
+    assert "SET w.status = 'booked'" in query
+    assert "w.sender_id = %s" in query
+    assert params == (TOMORROW, "10:00", 1, "ana")
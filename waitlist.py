@@ -0,0 +1,383 @@
+import heapq
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as Date
+
+import mysql.connector
+
+from database_connection import DbReservationSave
+
+logger = logging.getLogger(__name__)
+
+# Hours a patient has to answer an offer once it was shown to them
+OFFER_TIMEOUT_HOURS = int(os.environ.get("WAITLIST_OFFER_TIMEOUT_HOURS", "24"))
+# Hours an offer waits for the patient to come back before it goes to the next one
+UNSEEN_OFFER_TIMEOUT_HOURS = int(os.environ.get("WAITLIST_UNSEEN_OFFER_TIMEOUT_HOURS", "72"))
+# Seconds between two checks for unanswered offers
+OFFER_SWEEP_INTERVAL = 60
+
+createWaitlistTable = """
+CREATE TABLE IF NOT EXISTS waitlist
+(id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+sender_id varchar(255),
+first_name varchar(255),
+last_name varchar(255),
+date DATE,
+department varchar(255),
+appointment_id INT,
+offered_at DATETIME,
+shown_at DATETIME,
+status varchar(255) DEFAULT 'waiting',
+INDEX waitlist_queue (department, date, status),
+INDEX waitlist_sender (sender_id, status),
+INDEX waitlist_appointment (appointment_id))"""
+
+
+class Waitlist:
+    """Per (department, date) priority queues of patients waiting for a slot.
+
+    The `waitlist` table is the source of truth; each queue is loaded from it
+    the first time its key is used and then kept as a heap ordered by the row
+    id, so the patient who joined first is always popped first in O(log n).
+    An empty queue is rebuilt from the table before giving up, so entries
+    added by other action server processes are not missed.
+
+    An entry goes from 'waiting' to 'offered' when a canceled appointment is
+    offered to it. The offer is shown the next time the patient talks to the
+    bot; they then accept it ('accepted', later 'booked' by
+    `action_save_in_database`) or decline it ('declined'). Offers that are
+    declined, not answered within `offer_timeout_hours` of being shown, or
+    not seen within `unseen_offer_timeout_hours` ('expired') are offered
+    again to the next patient in the queue.
+
+    The background worker and the expiry sweep only start once the waitlist
+    is actually used.
+    """
+
+    def __init__(self, offer_timeout_hours=OFFER_TIMEOUT_HOURS, unseen_offer_timeout_hours=UNSEEN_OFFER_TIMEOUT_HOURS):
+        self.offer_timeout_hours = offer_timeout_hours
+        self.unseen_offer_timeout_hours = unseen_offer_timeout_hours
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._sweeper = None
+        self._stopped = threading.Event()
+
+    def _start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            # A single worker keeps backfills ordered and off the request path
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._sweeper = threading.Thread(target=self._expire_periodically, name="waitlist-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def join(self, sender_id, first_name, last_name, date, department):
+        self._start()
+        connection = DbReservationSave()
+        cursor = connection.cursor()
+        cursor.execute(createWaitlistTable)
+        connection.commit()
+
+        insert_waitlist_query = """
+        INSERT INTO waitlist (sender_id, first_name, last_name, date, department)
+        VALUES (%s, %s, %s, %s, %s)
+        """
+        cursor.execute(insert_waitlist_query, (sender_id, first_name, last_name, date, department.lower()))
+        connection.commit()
+        waitlist_id = cursor.lastrowid
+
+        with self._lock:
+            self._drop_past_queues()
+            key = (department.lower(), str(date))
+            if key in self._queues:
+                heapq.heappush(self._queues[key], (waitlist_id, sender_id))
+            else:
+                # Loading from the table also picks up the row inserted above
+                self._load_queue(cursor, key)
+
+        cursor.close()
+        connection.close()
+        return waitlist_id
+
+    def schedule_backfill(self, appointment_ids):
+        """Offer the given canceled appointments without blocking the caller."""
+        return self._submit(self.backfill, list(appointment_ids))
+
+    def _submit(self, function, *args):
+        self._start()
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        exception = future.exception()
+        if exception is not None:
+            logger.error("Waitlist task failed", exc_info=exception)
+
+    def backfill(self, appointment_ids):
+        if not appointment_ids:
+            return
+        connection = DbReservationSave()
+        cursor = connection.cursor()
+        touched_keys = set()
+        try:
+            cursor.execute(createWaitlistTable)
+            connection.commit()
+
+            # Skip past slots and slots that are already offered or booked again
+            placeholders = ", ".join(["%s"] * len(appointment_ids))
+            select_freed_query = f"""
+            SELECT a.id, a.date, s.specialty
+            FROM appointments AS a
+            JOIN medical_specialties AS s ON a.specialty_id = s.id
+            WHERE
+                a.id IN ({placeholders})
+                AND a.status = 'canceled'
+                AND a.date >= CURDATE()
+                AND NOT EXISTS (
+                    SELECT 1 FROM waitlist AS w
+                    WHERE w.appointment_id = a.id
+                    AND w.status IN ('offered', 'accepted', 'booked'))
+                AND NOT EXISTS (
+                    SELECT 1 FROM appointments AS b
+                    WHERE b.date = a.date AND b.time = a.time
+                    AND b.doctor_id = a.doctor_id AND b.status = 'active')
+            ORDER BY a.date, a.time
+            """
+            cursor.execute(select_freed_query, tuple(appointment_ids))
+            freed_appointments = cursor.fetchall()
+
+            update_waitlist_query = """
+            UPDATE waitlist SET status = 'offered', appointment_id = %s, offered_at = NOW(), shown_at = NULL
+            WHERE id = %s AND status = 'waiting'
+            """
+            with self._lock:
+                self._drop_past_queues()
+            for appointment_id, appointment_date, specialty in freed_appointments:
+                key = (specialty.lower(), str(appointment_date))
+                touched_keys.add(key)
+                waitlist_id = self._pop_next(cursor, key)
+                while waitlist_id is not None:
+                    cursor.execute(update_waitlist_query, (appointment_id, waitlist_id))
+                    connection.commit()
+                    if cursor.rowcount > 0:
+                        break
+                    # The entry was already handled by another process
+                    waitlist_id = self._pop_next(cursor, key)
+        except Exception:
+            # Popped entries may not have been offered, reload them from the table
+            with self._lock:
+                for key in touched_keys:
+                    self._queues.pop(key, None)
+            raise
+        finally:
+            cursor.close()
+            connection.close()
+
+    def _pop_next(self, cursor, key):
+        with self._lock:
+            if not self._queues.get(key):
+                # Rebuild it so entries added by other processes are not missed
+                self._load_queue(cursor, key)
+            queue = self._queues[key]
+            if not queue:
+                return None
+            waitlist_id, _ = heapq.heappop(queue)
+            return waitlist_id
+
+    def _drop_past_queues(self):
+        today = Date.today().isoformat()
+        for key in [key for key in self._queues if key[1] < today]:
+            del self._queues[key]
+
+    def expire_offers(self):
+        """Pass offers that were not answered in time on to the next patient."""
+        connection = DbReservationSave()
+        cursor = connection.cursor()
+        cursor.execute(createWaitlistTable)
+        connection.commit()
+
+        select_expired_query = """
+        SELECT w.id, w.appointment_id
+        FROM waitlist AS w
+        JOIN appointments AS a ON w.appointment_id = a.id
+        WHERE
+            w.status IN ('offered', 'accepted')
+            AND (w.shown_at < NOW() - INTERVAL %s HOUR
+                OR (w.shown_at IS NULL AND w.offered_at < NOW() - INTERVAL %s HOUR)
+                OR a.date < CURDATE())
+        """
+        cursor.execute(select_expired_query, (self.offer_timeout_hours, self.unseen_offer_timeout_hours))
+        expired_offers = cursor.fetchall()
+
+        update_waitlist_query = """
+        UPDATE waitlist SET status = 'expired'
+        WHERE id = %s AND status IN ('offered', 'accepted')
+        """
+        appointment_ids = []
+        for waitlist_id, appointment_id in expired_offers:
+            cursor.execute(update_waitlist_query, (waitlist_id,))
+            connection.commit()
+            if cursor.rowcount > 0:
+                appointment_ids.append(appointment_id)
+
+        cursor.close()
+        connection.close()
+        self.backfill(appointment_ids)
+
+    def _expire_periodically(self):
+        while not self._stopped.wait(OFFER_SWEEP_INTERVAL):
+            self._submit(self.expire_offers)
+
+    def pending_offer(self, sender_id):
+        """Return (waitlist_id, date, time, doctor, department) of the offer
+        waiting for this patient's answer, or None.
+
+        The first call for an offer marks it as shown, which starts the time
+        the patient has to answer it."""
+        try:
+            connection = DbReservationSave()
+            cursor = connection.cursor()
+            cursor.execute(createWaitlistTable)
+            connection.commit()
+
+            select_offer_query = """
+            SELECT w.id, a.date, a.time, d.doctor_name, s.specialty
+            FROM waitlist AS w
+            JOIN appointments AS a ON w.appointment_id = a.id
+            JOIN doctors AS d ON a.doctor_id = d.id
+            JOIN medical_specialties AS s ON a.specialty_id = s.id
+            WHERE
+                w.sender_id = %s
+                AND w.status = 'offered'
+                AND (w.shown_at IS NULL OR w.shown_at >= NOW() - INTERVAL %s HOUR)
+                AND a.date >= CURDATE()
+            ORDER BY w.id
+            LIMIT 1
+            """
+            cursor.execute(select_offer_query, (sender_id, self.offer_timeout_hours))
+            offer = cursor.fetchone()
+            if offer is not None:
+                cursor.execute("UPDATE waitlist SET shown_at = NOW() WHERE id = %s AND shown_at IS NULL", (offer[0],))
+                connection.commit()
+            cursor.close()
+            connection.close()
+        except mysql.connector.Error:
+            # Checking for offers must never break the conversation
+            logger.exception("Could not check the waitlist for %s", sender_id)
+            return None
+
+        if offer is None:
+            return None
+        # Offers left open by a previous run still have to expire
+        self._start()
+        return self._format_offer(offer)
+
+    @staticmethod
+    def _format_offer(offer):
+        waitlist_id, offer_date, offer_time, doctor_name, specialty = offer
+        # TIME columns come back as timedelta, e.g. 9:30:00 -> 9:30
+        return waitlist_id, str(offer_date), str(offer_time)[:-3], doctor_name, specialty
+
+    def accept(self, waitlist_id, sender_id):
+        """Hold the offered slot for the patient while they finish booking.
+
+        Return (waitlist_id, date, time, doctor, department) of the slot, or
+        None if the offer is no longer open."""
+        connection = DbReservationSave()
+        cursor = connection.cursor()
+        accept_offer_query = """
+        UPDATE waitlist SET status = 'accepted', shown_at = NOW()
+        WHERE id = %s AND sender_id = %s AND status = 'offered'
+        AND shown_at >= NOW() - INTERVAL %s HOUR
+        """
+        cursor.execute(accept_offer_query, (waitlist_id, sender_id, self.offer_timeout_hours))
+        connection.commit()
+
+        offer = None
+        if cursor.rowcount > 0:
+            select_offer_query = """
+            SELECT w.id, a.date, a.time, d.doctor_name, s.specialty
+            FROM waitlist AS w
+            JOIN appointments AS a ON w.appointment_id = a.id
+            JOIN doctors AS d ON a.doctor_id = d.id
+            JOIN medical_specialties AS s ON a.specialty_id = s.id
+            WHERE w.id = %s
+            """
+            cursor.execute(select_offer_query, (waitlist_id,))
+            offer = cursor.fetchone()
+        cursor.close()
+        connection.close()
+        return self._format_offer(offer) if offer else None
+
+    def decline(self, waitlist_id, sender_id):
+        connection = DbReservationSave()
+        cursor = connection.cursor()
+        cursor.execute("SELECT appointment_id FROM waitlist WHERE id = %s AND sender_id = %s", (waitlist_id, sender_id))
+        row = cursor.fetchone()
+        decline_offer_query = """
+        UPDATE waitlist SET status = 'declined'
+        WHERE id = %s AND sender_id = %s AND status IN ('offered', 'accepted')
+        """
+        cursor.execute(decline_offer_query, (waitlist_id, sender_id))
+        connection.commit()
+        declined = cursor.rowcount > 0
+        cursor.close()
+        connection.close()
+
+        if declined and row:
+            self.schedule_backfill([row[0]])
+        return declined
+
+    @staticmethod
+    def is_slot_taken(cursor, date, time, doctor_id, sender_id):
+        """Whether the slot is booked, or held by an offer to another patient."""
+        select_active_query = """
+        SELECT 1 FROM appointments
+        WHERE date = %s AND time = %s AND doctor_id = %s AND status = 'active'
+        """
+        cursor.execute(select_active_query, (date, time, doctor_id))
+        if cursor.fetchone():
+            return True
+
+        select_held_query = """
+        SELECT 1 FROM waitlist AS w
+        JOIN appointments AS a ON w.appointment_id = a.id
+        WHERE
+            a.date = %s AND a.time = %s AND a.doctor_id = %s
+            AND w.status IN ('offered', 'accepted')
+            AND w.sender_id <> %s
+        """
+        cursor.execute(select_held_query, (date, time, doctor_id, sender_id))
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def mark_booked(cursor, date, time, doctor_id, sender_id):
+        mark_booked_query = """
+        UPDATE waitlist AS w
+        JOIN appointments AS a ON w.appointment_id = a.id
+        SET w.status = 'booked'
+        WHERE
+            a.date = %s AND a.time = %s AND a.doctor_id = %s
+            AND w.status IN ('offered', 'accepted')
+            AND w.sender_id = %s
+        """
+        cursor.execute(mark_booked_query, (date, time, doctor_id, sender_id))
+
+    def _load_queue(self, cursor, key):
+        department, date = key
+        select_waiting_query = """
+        SELECT id, sender_id FROM waitlist
+        WHERE department = %s AND date = %s AND status = 'waiting'
+        """
+        cursor.execute(select_waiting_query, (department, date))
+        queue = [(waitlist_id, sender_id) for waitlist_id, sender_id in cursor.fetchall()]
+        heapq.heapify(queue)
+        self._queues[key] = queue
+
+
+waitlist = Waitlist()